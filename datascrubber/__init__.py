@@ -1,23 +1,75 @@
+import binascii
+import logging
+import os
 import random
 import time
-import logging
+import botocore.config
+import botocore.exceptions
 import dns.resolver
 import dns.name
 import hashlib
+import heapq
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from operator import itemgetter
 
 logger = logging.getLogger(__name__)
 
+# Adaptive retries throttle our own call rate instead of failing with
+# "max retries exceeded" when RDS starts rejecting Describe* calls.
+rds_client_config = botocore.config.Config(
+    retries={'mode': 'adaptive', 'max_attempts': 10},
+    max_pool_connections=32,
+)
+
+# Shared between worker threads so repeated lookups are answered from cache
+_resolver = dns.resolver.Resolver()
+_resolver.cache = dns.resolver.LRUCache(256)
+
+
+def _waiter_status(error):
+    response = error.last_response or {}
+    if 'Error' in response:
+        return response['Error'].get('Code')
+    if response.get('DBInstances'):
+        return response['DBInstances'][0]['DBInstanceStatus']
+    if response.get('DBSnapshots'):
+        return response['DBSnapshots'][0]['Status']
+    return None
+
+
+def _waiter_exception(error, action):
+    if error.kwargs.get('reason') == 'Max attempts exceeded':
+        return TimeoutError("Timed out {0}, last status: {1}".format(
+            action, _waiter_status(error)
+        ))
+
+    return Exception("Failed {0}, last status: {1}: {2}".format(
+        action, _waiter_status(error), error
+    ))
+
 
 class ScrubWorkspaceInstance:
-    def __init__(self, snapshot_finder, boto3_session, timeout=90, security_groups=None):
+    # Statuses the db_instance_available waiter treats as terminal failures
+    failed_instance_statuses = [
+        'deleted',
+        'deleting',
+        'failed',
+        'incompatible-restore',
+        'incompatible-parameters',
+    ]
+
+    def __init__(self, snapshot_finder, boto3_session, timeout=90, security_groups=None, rds_client=None):
         timestamp = datetime.now()
 
         self.boto3_session = boto3_session
-        self.rds_client = self.boto3_session.client('rds')
+        if rds_client is None:
+            rds_client = self.boto3_session.client('rds', config=rds_client_config)
+        self.rds_client = rds_client
         self.snapshot_finder = snapshot_finder
         self.timeout = timeout
-        self.password = "{0:x}".format(random.getrandbits(41 * 4))
+        # RDS MySQL master passwords are limited to 41 characters
+        self.password = binascii.hexlify(os.urandom(21)).decode()[0:41]
 
         self.source_snapshot = self.snapshot_finder.get_snapshot()
         self.instance_identifier = "scrubber-{0}-{1}".format(
@@ -107,14 +159,16 @@ class ScrubWorkspaceInstance:
             self.instance_identifier,
         )
 
-        response = self.rds_client.describe_db_snapshots(IncludeShared=True)
+        paginator = self.rds_client.get_paginator('describe_db_snapshots')
+        pages = paginator.paginate(
+            DBInstanceIdentifier=self.instance_identifier,
+            SnapshotType='manual',
+        )
+        # Snapshots still being created have no SnapshotCreateTime yet
         snapshots = [
-            s for s in response['DBSnapshots'] if s['DBInstanceIdentifier'] == self.instance_identifier
+            s for page in pages for s in page['DBSnapshots']
+            if 'SnapshotCreateTime' in s
         ]
-        snapshots.sort(
-            key=lambda x: x.get('SnapshotCreateTime', 0),
-            reverse=True
-        )
 
         logger.info(
             "%d snapshots for %s exist in RDS",
@@ -122,7 +176,11 @@ class ScrubWorkspaceInstance:
             self.instance_identifier,
         )
 
-        snaps_to_delete = snapshots[number_to_keep:]
+        snaps_to_delete = heapq.nsmallest(
+            max(0, len(snapshots) - number_to_keep),
+            snapshots,
+            key=itemgetter('SnapshotCreateTime'),
+        )
 
         logger.info(
             "%d older snapshots of %s identified for deletion (keeping %d)",
@@ -131,11 +189,21 @@ class ScrubWorkspaceInstance:
             number_to_keep
         )
 
-        for snap in snaps_to_delete:
+        def delete_snapshot(snap):
             logger.info("Deleting snapshot %s", snap['DBSnapshotIdentifier'])
-            self.rds_client.delete_db_snapshot(
-                DBSnapshotIdentifier=snap['DBSnapshotIdentifier'],
-            )
+            try:
+                self.rds_client.delete_db_snapshot(
+                    DBSnapshotIdentifier=snap['DBSnapshotIdentifier'],
+                )
+            except Exception as e:
+                logger.error(
+                    "Error deleting snapshot %s: %s",
+                    snap['DBSnapshotIdentifier'],
+                    e,
+                )
+
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            list(executor.map(delete_snapshot, snaps_to_delete))
 
     def __create_instance(self):
         rds = self.rds_client
@@ -162,29 +230,26 @@ class ScrubWorkspaceInstance:
             ]
         )
 
-        max_end_time = time.time() + 60 * self.timeout
-        while time.time() <= max_end_time:
-            poll_response = rds.describe_db_instances(
-                DBInstanceIdentifier=self.instance_identifier
-            )
-            self.instance = poll_response['DBInstances'][0]
+        logger.info(
+            "Waiting for %s to become available",
+            self.instance_identifier,
+        )
 
-            logger.info(
-                "Waiting for %s to become available, current status: '%s'",
-                self.instance_identifier,
-                self.instance['DBInstanceStatus'],
+        try:
+            self.__wait(
+                'db_instance_available',
+                time.time() + 60 * self.timeout,
+                DBInstanceIdentifier=self.instance_identifier,
             )
-
-            if self.instance['DBInstanceStatus'] == 'available':
-                return
-            else:
-                time.sleep(10)
-
-        raise TimeoutError(
-            "Timed out creating RDS instance {0}".format(
+        except botocore.exceptions.WaiterError as e:
+            raise _waiter_exception(e, "creating RDS instance {0}".format(
                 self.instance_identifier
-            )
+            ))
+
+        response = rds.describe_db_instances(
+            DBInstanceIdentifier=self.instance_identifier
         )
+        self.instance = response['DBInstances'][0]
 
     def __apply_instance_modifications(self):
         rds = self.rds_client
@@ -207,69 +272,102 @@ class ScrubWorkspaceInstance:
             ApplyImmediately=True,
         )
 
-        max_end_time = time.time() + 60 * self.timeout
-        while time.time() <= max_end_time:
-            poll_response = rds.describe_db_instances(
+        # The instance is usually still 'available' straight after
+        # modify_db_instance, so the db_instance_available waiter can return
+        # before the changes are applied. Poll with a single describe per
+        # attempt, checking the status and pending changes together. Back
+        # off from 2s up to 30s between attempts, with jitter.
+        deadline = time.time() + 60 * self.timeout
+        delay = 2
+        while True:
+            response = rds.describe_db_instances(
                 DBInstanceIdentifier=self.instance_identifier
             )
-            pending = list(
-                poll_response['DBInstances'][0]['PendingModifiedValues'].keys()
-            )
+            self.instance = response['DBInstances'][0]
 
-            if len(pending) > 0:
-                logger.info(
-                    "Modifications to %s still pending: %s",
-                    self.instance_identifier,
-                    pending,
-                )
-                time.sleep(10)
-            else:
+            status = self.instance['DBInstanceStatus']
+            pending = list(self.instance['PendingModifiedValues'].keys())
+            if status == 'available' and len(pending) == 0:
                 return
 
-        raise TimeoutError(
-            "Timed out applying changes to RDS instance {0}".format(
-                self.instance_identifier
+            if status in self.failed_instance_statuses:
+                raise Exception(
+                    "Failed applying changes to RDS instance {0}, last status: {1}".format(
+                        self.instance_identifier,
+                        status,
+                    )
+                )
+
+            if time.time() >= deadline:
+                raise TimeoutError(
+                    "Timed out applying changes to RDS instance {0}, last status: {1}, still pending: {2}".format(
+                        self.instance_identifier,
+                        status,
+                        pending,
+                    )
+                )
+
+            logger.info(
+                "Waiting for modifications to %s, current status: '%s', pending: %s",
+                self.instance_identifier,
+                status,
+                pending,
             )
-        )
+            time.sleep(min(
+                delay + random.uniform(0, delay * 0.1),
+                max(0, deadline - time.time()),
+            ))
+            delay = min(delay * 1.5, 30)
 
     def __wait_for_final_snapshot(self):
-        rds = self.rds_client
-
-        max_end_time = time.time() + 60 * self.timeout
-        while time.time() <= max_end_time:
-            try:
-                logger.info(
-                    "Waiting for snapshot %s to become available. Timeout: %s minutes",
-                    self.final_snapshot_identifier,
-                    self.timeout,
-                )
+        logger.info(
+            "Waiting for snapshot %s to become available. Timeout: %s minutes",
+            self.final_snapshot_identifier,
+            self.timeout,
+        )
 
-                poll_response = rds.describe_db_snapshots(
-                    DBSnapshotIdentifier=self.final_snapshot_identifier
-                )
+        # The final snapshot doesn't exist until the instance has shut down,
+        # so wait for the deletion to finish before polling the snapshot.
+        # Both waits share the one timeout.
+        deadline = time.time() + 60 * self.timeout
+        try:
+            self.__wait(
+                'db_instance_deleted',
+                deadline,
+                DBInstanceIdentifier=self.instance_identifier,
+            )
+            self.__wait(
+                'db_snapshot_available',
+                deadline,
+                DBSnapshotIdentifier=self.final_snapshot_identifier,
+            )
+        except botocore.exceptions.WaiterError as e:
+            raise _waiter_exception(e, "waiting for snapshot {0}".format(
+                self.final_snapshot_identifier
+            ))
 
-                if poll_response['DBSnapshots'][0]['Status'] == 'available':
-                    logger.info(
-                        "Snapshot %s is now available",
-                        self.final_snapshot_identifier
-                    )
-                    return
+        logger.info(
+            "Snapshot %s is now available",
+            self.final_snapshot_identifier
+        )
 
-                else:
-                    time.sleep(10)
-            except Exception as e:
-                if e.response['Error']['Code'] == 'DBSnapshotNotFound':
-                    time.sleep(10)
-                else:
-                    raise(e)
+    def __wait(self, waiter_name, deadline, **kwargs):
+        delay = 15
+        attempts = max(1, int((deadline - time.time()) // delay))
+        self.rds_client.get_waiter(waiter_name).wait(
+            WaiterConfig={'Delay': delay, 'MaxAttempts': attempts},
+            **kwargs
+        )
 
 
 class RdsSnapshotFinder:
     rds_domain = dns.name.from_text('rds.amazonaws.com.')
 
-    def __init__(self, boto3_session, hostname=None, source_instance_identifier=None, snapshot_identifier=None):
+    def __init__(self, boto3_session, hostname=None, source_instance_identifier=None, snapshot_identifier=None, rds_client=None):
         self.boto3_session = boto3_session
-        self.rds_client = self.boto3_session.client('rds')
+        if rds_client is None:
+            rds_client = self.boto3_session.client('rds', config=rds_client_config)
+        self.rds_client = rds_client
 
         if (hostname is None and source_instance_identifier is None and snapshot_identifier is None):
             raise Exception("One of hostname, source_instance_identifier, snapshot_identifier must be provided")
@@ -309,20 +407,21 @@ class RdsSnapshotFinder:
                 DBInstanceIdentifier=source_instance_id,
             )
 
-            if len(response['DBSnapshots']) == 0:
+            snapshots = [
+                s for s in response['DBSnapshots']
+                if 'SnapshotCreateTime' in s
+            ]
+
+            if len(snapshots) == 0:
                 raise Exception("No snapshots found")
 
             logger.debug(
                 "Found %d snapshots for %s",
-                len(response['DBSnapshots']),
+                len(snapshots),
                 source_instance_id,
             )
 
-            response['DBSnapshots'].sort(
-                key=lambda x: x.get('SnapshotCreateTime', 0),
-                reverse=True
-            )
-            most_recent = response['DBSnapshots'][0]
+            most_recent = max(snapshots, key=itemgetter('SnapshotCreateTime'))
             self.snapshot_identifier = most_recent['DBSnapshotIdentifier']
 
             logger.info("Using snapshot %s", self.snapshot_identifier)
@@ -345,28 +444,34 @@ class RdsSnapshotFinder:
             if self.source_instance_identifier is None:
                 logger.info("Discovering source RDS instance...")
 
-                rds_instances = self.rds_client.describe_db_instances()
+                paginator = self.rds_client.get_paginator('describe_db_instances')
+                instances_by_address = {}
+                instance_count = 0
+                for page in paginator.paginate():
+                    for i in page['DBInstances']:
+                        instance_count += 1
+                        if 'Endpoint' in i:
+                            instances_by_address[i['Endpoint']['Address']] = i
 
                 logger.debug(
                     "Enumerated %d RDS instances",
-                    len(rds_instances['DBInstances'])
+                    instance_count
+                )
+
+                endpoint_address = self.get_rds_endpoint_address()
+                if endpoint_address not in instances_by_address:
+                    raise Exception("Couldn't find an RDS instance matching endpoint address %s" % endpoint_address)
+
+                instance = instances_by_address[endpoint_address]
+                logger.info(
+                    "RDS instance %s matches endpoint address %s:%s",
+                    instance['DBInstanceIdentifier'],
+                    instance['Endpoint']['Address'],
+                    instance['Endpoint']['Port'],
                 )
 
-                for instance in rds_instances['DBInstances']:
-                    if 'Endpoint' in instance and instance['Endpoint']['Address'] == self.get_rds_endpoint_address():
-                        logger.info(
-                            "RDS instance %s matches endpoint address %s:%s",
-                            instance['DBInstanceIdentifier'],
-                            instance['Endpoint']['Address'],
-                            instance['Endpoint']['Port'],
-                        )
-
-                        self.source_instance = instance
-                        self.source_instance_identifier = instance['DBInstanceIdentifier']
-                        break
-
-                if self.source_instance is None:
-                    raise Exception("Couldn't find an RDS instance matching endpoint address %s" % self.get_rds_endpoint_address())
+                self.source_instance = instance
+                self.source_instance_identifier = instance['DBInstanceIdentifier']
             else:
                 logger.info("Looking up RDS instance %s ...", self.source_instance_identifier)
                 # An exception will be raised if the instance doesn't exist
@@ -387,8 +492,7 @@ class RdsSnapshotFinder:
         if self.rds_endpoint_address is None:
             logger.info("Discovering RDS endpoint address via DNS...")
 
-            resolver = dns.resolver.Resolver()
-            resolution = resolver.query(self.get_hostname())
+            resolution = _resolver.query(self.get_hostname())
             cname = resolution.canonical_name
 
             if not cname.is_subdomain(self.rds_domain):
@@ -8,7 +8,7 @@ import traceback
 import boto3
 import socket
 
-from . import ScrubWorkspaceInstance, RdsSnapshotFinder
+from . import ScrubWorkspaceInstance, RdsSnapshotFinder, rds_client_config
 from .task_managers import Mysql, Postgresql
 
 
@@ -327,18 +327,20 @@ def worker(dbms, hostname=None, instance=None, snapshot=None, region=None, targe
         # We need a boto3 session per thread
         # https://boto3.readthedocs.io/en/latest/guide/resources.html#multithreading-multiprocessing
         session = boto3.session.Session(region_name=region)
-        rds_client = session.client('rds')
+        rds_client = session.client('rds', config=rds_client_config)
 
         snapshot_finder = RdsSnapshotFinder(
             boto3_session=session,
             hostname=hostname,
             source_instance_identifier=instance,
             snapshot_identifier=snapshot,
+            rds_client=rds_client,
         )
 
         workspace = ScrubWorkspaceInstance(
             snapshot_finder,
             session,
+            rds_client=rds_client,
         )
 
         if dbms == 'mysql':
@@ -349,8 +351,7 @@ def worker(dbms, hostname=None, instance=None, snapshot=None, region=None, targe
             raise Exception("DBMS not supported: %s" % dbms)
 
         success = True
-        for task in task_manager.get_viable_tasks():
-            (success, err) = task_manager.run_task(task)
+        for task, (success, err) in task_manager.run_all():
             if not success:
                 logger.error(
                     "Task %s failed. A final snapshot will not be generated, "
@@ -1,6 +1,5 @@
 import logging
 import mysql.connector
-import re
 import subprocess
 import shlex
 import time
@@ -66,19 +65,19 @@ class Mysql:
         available_dbs = [r[0] for r in rows]
         logger.info("Databases found: %s", available_dbs)
 
-        r = re.compile('{0}$'.format(self.db_suffix))
+        suffix_length = len(self.db_suffix)
         for database_name in available_dbs:
-            normalised_name = r.sub('', database_name)
+            normalised_name = database_name
+            if suffix_length > 0 and database_name.endswith(self.db_suffix):
+                normalised_name = database_name[:-suffix_length]
             self.db_realnames[normalised_name] = database_name
 
-    def get_viable_tasks(self):
-        if self.viable_tasks is None:
-            self.viable_tasks = list(
-                set(self.scrub_functions.keys()) &
-                set(self.db_realnames.keys())
-            )
-            logger.info("Viable scrub tasks: %s", self.viable_tasks)
+        self.viable_tasks = frozenset(self.scrub_functions).intersection(
+            self.db_realnames
+        )
+        logger.info("Viable scrub tasks: %s", list(self.viable_tasks))
 
+    def get_viable_tasks(self):
         return self.viable_tasks
 
     def run_task(self, task):
@@ -108,6 +107,16 @@ class Mysql:
 
             return (False, e)
 
+    def run_all(self):
+        results = []
+        for task in self.get_viable_tasks():
+            (success, err) = self.run_task(task)
+            results.append((task, (success, err)))
+            if not success:
+                break
+
+        return results
+
     def export_to_s3(self, database, s3_url_prefix):
         endpoint = self.workspace.get_endpoint()
 
@@ -1,10 +1,10 @@
 import logging
 import psycopg2
-import re
 import subprocess
 import shlex
 import os
 import time
+from concurrent.futures import ThreadPoolExecutor
 
 import datascrubber.tasks
 
@@ -43,6 +43,11 @@ class Postgresql:
             host=instance['Endpoint']['Address'],
             port=instance['Endpoint']['Port'],
             dbname=dbname,
+            connect_timeout=10,
+            keepalives=1,
+            keepalives_idle=30,
+            keepalives_interval=10,
+            keepalives_count=3,
         )
         connection.autocommit = True
         return connection
@@ -51,33 +56,33 @@ class Postgresql:
         logger.info("Looking for available databases in Postgres")
 
         cnx = self._get_connection('postgres')
-        cursor = cnx.cursor()
-        cursor.execute(
-            "SELECT datname FROM pg_database "
-            "WHERE datname NOT IN ("
-            "  'template0', "
-            "  'rdsadmin', "
-            "  'postgres', "
-            "  'template1' "
-            ") AND datistemplate IS FALSE"
-        )
-        rows = cursor.fetchall()
-        available_dbs = [r[0] for r in rows]
-        logger.info("Databases found: %s", available_dbs)
+        try:
+            cursor = cnx.cursor()
+            cursor.execute(
+                "SELECT datname FROM pg_database "
+                "WHERE NOT datistemplate AND datallowconn AND datname <> ALL(%s)",
+                (['template0', 'rdsadmin', 'postgres', 'template1'],)
+            )
 
-        r = re.compile('{0}$'.format(self.db_suffix))
-        for database_name in available_dbs:
-            normalised_name = r.sub('', database_name)
-            self.db_realnames[normalised_name] = database_name
+            suffix_length = len(self.db_suffix)
+            for (database_name,) in cursor:
+                normalised_name = database_name
+                if suffix_length > 0 and database_name.endswith(self.db_suffix):
+                    normalised_name = database_name[:-suffix_length]
+                self.db_realnames[normalised_name] = database_name
 
-    def get_viable_tasks(self):
-        if self.viable_tasks is None:
-            self.viable_tasks = list(
-                set(self.scrub_functions.keys()) &
-                set(self.db_realnames.keys())
-            )
-            logger.info("Viable scrub tasks: %s", self.viable_tasks)
+            cursor.close()
+        finally:
+            cnx.close()
 
+        logger.info("Databases found: %s", list(self.db_realnames.values()))
+
+        self.viable_tasks = frozenset(self.scrub_functions).intersection(
+            self.db_realnames
+        )
+        logger.info("Viable scrub tasks: %s", list(self.viable_tasks))
+
+    def get_viable_tasks(self):
         return self.viable_tasks
 
     def run_task(self, task):
@@ -90,9 +95,10 @@ class Postgresql:
 
         logger.info("Running scrub task: %s", task)
         cnx = self._get_connection(self.db_realnames[task])
-        cursor = cnx.cursor()
         try:
+            cursor = cnx.cursor()
             self.scrub_functions[task](cursor)
+            cursor.close()
             return (True, None)
 
         except Exception as e:
@@ -100,6 +106,20 @@ class Postgresql:
 
             return (False, e)
 
+        finally:
+            cnx.close()
+
+    def run_all(self):
+        tasks = list(self.get_viable_tasks())
+        if len(tasks) == 0:
+            return []
+
+        # Each task works on its own database, and so its own connection
+        with ThreadPoolExecutor(max_workers=len(tasks)) as executor:
+            results = list(executor.map(self.run_task, tasks))
+
+        return list(zip(tasks, results))
+
     def export_to_s3(self, database, s3_url_prefix):
         endpoint = self.workspace.get_endpoint()
 